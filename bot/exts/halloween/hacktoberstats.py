@@ -1,12 +1,14 @@
+import asyncio
 import logging
 import random
 import re
+import time
 from collections import Counter
 from datetime import datetime, timedelta
-from typing import List, Optional, Tuple, Union
+from typing import Dict, List, Optional, Tuple, Union
 
-import aiohttp
 import discord
+from aiohttp import ClientResponse
 from async_rediscache import RedisCache
 from discord.ext import commands
 
@@ -16,8 +18,23 @@ from bot.utils.decorators import in_month, whitelist_override
 log = logging.getLogger(__name__)
 
 CURRENT_YEAR = datetime.now().year  # Used to construct GH API query
+OCT3 = datetime(CURRENT_YEAR, 10, 3, 23, 59, 59)  # PRs created after this must be in a 'hacktoberfest' repo
 PRS_FOR_SHIRT = 4  # Minimum number of PRs before a shirt is awarded
 REVIEW_DAYS = 14  # number of days needed after PR can be mature
+TOPICS_CONCURRENCY = 5  # Maximum number of repo topics requests in flight at once
+TOPICS_CACHE_TTL = 60 * 60  # Seconds for which fetched repo topics are reused
+TOPICS_CACHE_SIZE = 512  # Maximum number of repos whose topics are kept in the cache
+STATS_CACHE_TTL = 5 * 60  # Seconds for which a user's stats embed is reused
+GITHUB_CONCURRENCY = 10  # Maximum number of GitHub API requests in flight at once across all invocations
+GITHUB_MAX_RETRIES = 3  # Number of times a rate limited GitHub API request is retried
+GITHUB_MAX_RETRY_DELAY = 60  # Longest wait in seconds for a rate limit before giving up on the request
+# Progress message for each number of PRs, the last one being used for PRS_FOR_SHIRT PRs or more
+SHIRT_MESSAGES = tuple(
+    f"**{{username}} is {PRS_FOR_SHIRT - n} PRs away from a T-shirt or a tree!**" for n in range(PRS_FOR_SHIRT - 1)
+) + (
+    "**{username} is 1 PR away from a T-shirt or a tree!**",
+    "**{username} is eligible for a T-shirt or a tree!**",
+)
 HACKTOBER_WHITELIST = WHITELISTED_CHANNELS + (Channels.hacktoberfest_2020,)
 
 REQUEST_HEADERS = {"User-Agent": "Python Discord Hacktoberbot"}
@@ -27,6 +44,20 @@ if GITHUB_TOKEN := Tokens.github:
     REQUEST_HEADERS["Authorization"] = f"token {GITHUB_TOKEN}"
     GITHUB_TOPICS_ACCEPT_HEADER["Authorization"] = f"token {GITHUB_TOKEN}"
 
+# Search for the user's public, non-draft PRs created during October; only the username varies per call
+SEARCH_URL = (
+    "https://api.github.com/search/issues?q="
+    "+type:pr"
+    "+is:public"
+    "+author:{username}"
+    "+-is:draft"
+    f"+created:{CURRENT_YEAR}-09-30T10:00Z..{CURRENT_YEAR}-11-01T12:00Z"
+    "&per_page=100"  # Maximum page size allowed by the search API
+)
+TOPICS_URL = "https://api.github.com/repos/{shortname}/topics"
+
+REPO_SHORTNAME_REGEX = re.compile(r"https?://api\.github\.com/repos/([/\-\_\.\w]+)")
+
 GITHUB_NONEXISTENT_USER_MESSAGE = (
     "The listed users cannot be searched either because the users do not exist "
     "or you do not have permission to view the users."
@@ -41,6 +72,11 @@ class HacktoberStats(commands.Cog):
 
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        # Maps repo shortnames to the time their topics were fetched and the topics themselves
+        self._topics_cache: Dict[str, Tuple[float, List[str]]] = {}
+        self._request_semaphore = asyncio.Semaphore(GITHUB_CONCURRENCY)
+        # Maps GitHub usernames to the time their stats embed was built and the embed itself
+        self._stats_cache: Dict[str, Tuple[float, discord.Embed]] = {}
 
     @in_month(Month.SEPTEMBER, Month.OCTOBER, Month.NOVEMBER)
     @commands.group(name="hacktoberstats", aliases=("hackstats",), invoke_without_command=True)
@@ -56,8 +92,8 @@ class HacktoberStats(commands.Cog):
         if not github_username:
             author_id, author_mention = self._author_mention_from_context(ctx)
 
-            if await self.linked_accounts.contains(author_id):
-                github_username = await self.linked_accounts.get(author_id)
+            github_username = await self.linked_accounts.get(author_id)
+            if github_username:
                 logging.info(f"Getting stats for {author_id} linked GitHub account '{github_username}'")
             else:
                 msg = (
@@ -81,8 +117,8 @@ class HacktoberStats(commands.Cog):
         """
         author_id, author_mention = self._author_mention_from_context(ctx)
         if github_username:
-            if await self.linked_accounts.contains(author_id):
-                old_username = await self.linked_accounts.get(author_id)
+            old_username = await self.linked_accounts.get(author_id)
+            if old_username:
                 logging.info(f"{author_id} has changed their github link from '{old_username}' to '{github_username}'")
                 await ctx.send(f"{author_mention}, your GitHub username has been updated to: '{github_username}'")
             else:
@@ -122,7 +158,15 @@ class HacktoberStats(commands.Cog):
         If a valid github_username is provided, an embed is generated and posted to the channel
 
         Otherwise, post a helpful error message
+
+        Embeds are cached for `STATS_CACHE_TTL` seconds, so users refreshing their stats
+        don't trigger a new round of GitHub API requests.
         """
+        cached = self._stats_cache.get(github_username)
+        if cached and time.monotonic() - cached[0] < STATS_CACHE_TTL:
+            await ctx.send('Here are some stats!', embed=cached[1])
+            return
+
         async with ctx.typing():
             prs = await self.get_october_prs(github_username)
 
@@ -138,22 +182,27 @@ class HacktoberStats(commands.Cog):
 
             if prs:
                 stats_embed = await self.build_embed(github_username, prs)
+                self._cache_stats(github_username, stats_embed)
                 await ctx.send('Here are some stats!', embed=stats_embed)
             else:
                 await ctx.send(f"No valid Hacktoberfest PRs found for '{github_username}'")
 
+    def _cache_stats(self, github_username: str, stats_embed: discord.Embed) -> None:
+        """Cache `stats_embed` for `github_username`, evicting any expired entries."""
+        now = time.monotonic()
+        self._stats_cache = {
+            username: entry for username, entry in self._stats_cache.items()
+            if now - entry[0] < STATS_CACHE_TTL
+        }
+        self._stats_cache[github_username] = (now, stats_embed)
+
     async def build_embed(self, github_username: str, prs: List[dict]) -> discord.Embed:
         """Return a stats embed built from github_username's PRs."""
         logging.info(f"Building Hacktoberfest embed for GitHub user: '{github_username}'")
         in_review, accepted = await self._categorize_prs(prs)
 
         n = len(accepted) + len(in_review)  # Total number of PRs
-        if n >= PRS_FOR_SHIRT:
-            shirtstr = f"**{github_username} is eligible for a T-shirt or a tree!**"
-        elif n == PRS_FOR_SHIRT - 1:
-            shirtstr = f"**{github_username} is 1 PR away from a T-shirt or a tree!**"
-        else:
-            shirtstr = f"**{github_username} is {PRS_FOR_SHIRT - n} PRs away from a T-shirt or a tree!**"
+        shirtstr = SHIRT_MESSAGES[min(n, PRS_FOR_SHIRT)].format(username=github_username)
 
         stats_embed = discord.Embed(
             title=f"{github_username}'s Hacktoberfest",
@@ -188,8 +237,7 @@ class HacktoberStats(commands.Cog):
         logging.info(f"Hacktoberfest PR built for GitHub user '{github_username}'")
         return stats_embed
 
-    @staticmethod
-    async def get_october_prs(github_username: str) -> Optional[List[dict]]:
+    async def get_october_prs(self, github_username: str) -> Optional[List[dict]]:
         """
         Query GitHub's API for PRs created during the month of October by github_username.
 
@@ -213,32 +261,20 @@ class HacktoberStats(commands.Cog):
         None will be returned when the GitHub user was not found.
         """
         logging.info(f"Fetching Hacktoberfest Stats for GitHub user: '{github_username}'")
-        base_url = "https://api.github.com/search/issues?q="
-        action_type = "pr"
-        is_query = "public"
-        not_query = "draft"
-        date_range = f"{CURRENT_YEAR}-09-30T10:00Z..{CURRENT_YEAR}-11-01T12:00Z"
-        per_page = "300"
-        query_url = (
-            f"{base_url}"
-            f"+type:{action_type}"
-            f"+is:{is_query}"
-            f"+author:{github_username}"
-            f"+-is:{not_query}"
-            f"+created:{date_range}"
-            f"&per_page={per_page}"
-        )
+        query_url = SEARCH_URL.format(username=github_username)
         logging.debug(f"GitHub query URL generated: {query_url}")
 
-        jsonresp = await HacktoberStats._fetch_url(query_url, REQUEST_HEADERS)
-        if "message" in jsonresp.keys():
+        jsonresp = await self._fetch_url(query_url, REQUEST_HEADERS)
+        if "message" in jsonresp:
             # One of the parameters is invalid, short circuit for now
-            api_message = jsonresp["errors"][0]["message"]
+            # Errors such as rate limiting only come with a top level message
+            errors = jsonresp.get("errors")
+            api_message = errors[0]["message"] if errors else jsonresp["message"]
 
             # Ignore logging non-existent users or users we do not have permission to see
             if api_message == GITHUB_NONEXISTENT_USER_MESSAGE:
                 logging.debug(f"No GitHub user found named '{github_username}'")
-                return
+                return None
             else:
                 logging.error(f"GitHub API request for '{github_username}' failed with message: {api_message}")
             return []  # No October PRs were found due to error
@@ -250,29 +286,27 @@ class HacktoberStats(commands.Cog):
 
         logging.info(f"Found {len(jsonresp['items'])} Hacktoberfest PRs for GitHub user: '{github_username}'")
         outlist = []  # list of pr information dicts that will get returned
-        oct3 = datetime(int(CURRENT_YEAR), 10, 3, 23, 59, 59, tzinfo=None)
-        hackto_topics = {}  # cache whether each repo has the appropriate topic (bool values)
+        needs_topics = []  # PRs which only count if their repo has the 'hacktoberfest' topic
         for item in jsonresp["items"]:
             shortname = HacktoberStats._get_shortname(item["repository_url"])
             itemdict = {
                 "repo_url": f"https://www.github.com/{shortname}",
                 "repo_shortname": shortname,
-                "created_at": datetime.strptime(
-                    item["created_at"], r"%Y-%m-%dT%H:%M:%SZ"
-                ),
+                # Python 3.8's fromisoformat doesn't understand the trailing 'Z' of GitHub's timestamps
+                "created_at": datetime.fromisoformat(item["created_at"].rstrip("Z")),
                 "number": item["number"]
             }
 
             # If the PR has 'invalid' or 'spam' labels, the PR must be
             # either merged or approved for it to be included
             if HacktoberStats._has_label(item, ["invalid", "spam"]):
-                if not await HacktoberStats._is_accepted(itemdict):
+                if not await self._is_accepted(itemdict):
                     continue
 
             # PRs before oct 3 no need to check for topics
             # continue the loop if 'hacktoberfest-accepted' is labelled then
             # there is no need to check for its topics
-            if itemdict["created_at"] < oct3:
+            if itemdict["created_at"] < OCT3:
                 outlist.append(itemdict)
                 continue
 
@@ -281,33 +315,90 @@ class HacktoberStats(commands.Cog):
                 outlist.append(itemdict)
                 continue
 
-            # No need to query GitHub if repo topics are fetched before already
-            if shortname in hackto_topics.keys():
-                if hackto_topics[shortname]:
-                    outlist.append(itemdict)
-                    continue
-            # Fetch topics for the PR's repo
-            topics_query_url = f"https://api.github.com/repos/{shortname}/topics"
-            logging.debug(f"Fetching repo topics for {shortname} with url: {topics_query_url}")
-            jsonresp2 = await HacktoberStats._fetch_url(topics_query_url, GITHUB_TOPICS_ACCEPT_HEADER)
-            if jsonresp2.get("names") is None:
-                logging.error(f"Error fetching topics for {shortname}: {jsonresp2['message']}")
-                continue  # Assume the repo doesn't have the `hacktoberfest` topic if API  request errored
-
-            # PRs after oct 3 that doesn't have 'hacktoberfest-accepted' label
-            # must be in repo with 'hacktoberfest' topic
-            if "hacktoberfest" in jsonresp2["names"]:
-                hackto_topics[shortname] = True  # Cache result in the dict for later use if needed
-                outlist.append(itemdict)
+            needs_topics.append(itemdict)
+
+        # PRs after oct 3 that doesn't have 'hacktoberfest-accepted' label
+        # must be in repo with 'hacktoberfest' topic.
+        # Each repo is only queried once, and the requests are made concurrently
+        shortnames = list({pr["repo_shortname"] for pr in needs_topics})
+        semaphore = asyncio.Semaphore(TOPICS_CONCURRENCY)
+        topics = await asyncio.gather(*(self._get_topics(shortname, semaphore) for shortname in shortnames))
+        hackto_topics = {
+            shortname: "hacktoberfest" in names for shortname, names in zip(shortnames, topics)
+        }
+
+        outlist.extend(pr for pr in needs_topics if hackto_topics[pr["repo_shortname"]])
         return outlist
 
+    async def _get_topics(self, shortname: str, semaphore: asyncio.Semaphore) -> List[str]:
+        """
+        Fetch the topics of the repo `shortname`.
+
+        Topics are cached for `TOPICS_CACHE_TTL` seconds, so repeated lookups of the same
+        repo don't hit the API. `semaphore` limits how many of these requests may run at
+        the same time. An empty list is returned if the API request errored.
+        """
+        cached = self._topics_cache.get(shortname)
+        if cached and time.monotonic() - cached[0] < TOPICS_CACHE_TTL:
+            return cached[1]
+
+        topics_query_url = TOPICS_URL.format(shortname=shortname)
+        logging.debug(f"Fetching repo topics for {shortname} with url: {topics_query_url}")
+        async with semaphore:
+            jsonresp = await self._fetch_url(topics_query_url, GITHUB_TOPICS_ACCEPT_HEADER)
+
+        if jsonresp.get("names") is None:
+            logging.error(f"Error fetching topics for {shortname}: {jsonresp['message']}")
+            return []  # Assume the repo doesn't have the `hacktoberfest` topic if API request errored
+
+        # Re-insert so the dict stays ordered from oldest to newest, then evict the oldest entry if full
+        self._topics_cache.pop(shortname, None)
+        if len(self._topics_cache) >= TOPICS_CACHE_SIZE:
+            del self._topics_cache[next(iter(self._topics_cache))]
+        self._topics_cache[shortname] = (time.monotonic(), jsonresp["names"])
+
+        return jsonresp["names"]
+
+    async def _fetch_url(self, url: str, headers: dict) -> Union[dict, list]:
+        """
+        Retrieve API response from URL using the bot's shared HTTP session.
+
+        Rate limited requests are retried up to `GITHUB_MAX_RETRIES` times, waiting as long as
+        GitHub asks through the `Retry-After` header, or backing off exponentially otherwise.
+        """
+        for attempt in range(GITHUB_MAX_RETRIES + 1):
+            async with self._request_semaphore:
+                async with self.bot.http_session.get(url, headers=headers) as resp:
+                    delay = self._get_retry_delay(resp, attempt)
+                    if delay is None or attempt == GITHUB_MAX_RETRIES:
+                        return await resp.json()
+
+            logging.warning(f"GitHub API rate limit hit for {url}, retrying in {delay} seconds")
+            await asyncio.sleep(delay)
+
     @staticmethod
-    async def _fetch_url(url: str, headers: dict) -> dict:
-        """Retrieve API response from URL."""
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers) as resp:
-                jsonresp = await resp.json()
-        return jsonresp
+    def _get_retry_delay(resp: ClientResponse, attempt: int) -> Optional[float]:
+        """
+        Return how many seconds to wait before retrying a rate limited `resp`.
+
+        None is returned if the response wasn't rate limited, or if it shouldn't be retried
+        because the wait would be too long.
+        """
+        if resp.status not in (403, 429):
+            return None
+
+        if retry_after := resp.headers.get("Retry-After"):
+            delay = float(retry_after)
+        elif resp.headers.get("X-RateLimit-Remaining") == "0":
+            # The primary rate limit is exhausted, which can take up to an hour to reset
+            logging.error(f"GitHub API rate limit exhausted, resets at {resp.headers.get('X-RateLimit-Reset')}")
+            return None
+        elif resp.status == 429:
+            delay = 2 ** attempt
+        else:
+            return None  # A plain 403, e.g. missing permissions
+
+        return delay if delay <= GITHUB_MAX_RETRY_DELAY else None
 
     @staticmethod
     def _has_label(pr: dict, labels: Union[List[str], str]) -> bool:
@@ -326,21 +417,20 @@ class HacktoberStats(commands.Cog):
                 return True
         return False
 
-    @staticmethod
-    async def _is_accepted(pr: dict) -> bool:
+    async def _is_accepted(self, pr: dict) -> bool:
         """Check if a PR is merged, approved, or labelled hacktoberfest-accepted."""
         # checking for merge status
         query_url = f"https://api.github.com/repos/{pr['repo_shortname']}/pulls/"
         query_url += str(pr["number"])
-        jsonresp = await HacktoberStats._fetch_url(query_url, REQUEST_HEADERS)
+        jsonresp = await self._fetch_url(query_url, REQUEST_HEADERS)
 
-        if "message" in jsonresp.keys():
+        if "message" in jsonresp:
             logging.error(
                 f"Error fetching PR stats for #{pr['number']} in repo {pr['repo_shortname']}:\n"
                 f"{jsonresp['message']}"
             )
             return False
-        if ("merged" in jsonresp.keys()) and jsonresp["merged"]:
+        if jsonresp.get("merged"):
             return True
 
         # checking for the label, using `jsonresp` which has the label information
@@ -349,7 +439,7 @@ class HacktoberStats(commands.Cog):
 
         # checking approval
         query_url += "/reviews"
-        jsonresp2 = await HacktoberStats._fetch_url(query_url, REQUEST_HEADERS)
+        jsonresp2 = await self._fetch_url(query_url, REQUEST_HEADERS)
         if isinstance(jsonresp2, dict):
             # if API request is unsuccessful it will be a dict with the error in 'message'
             logging.error(
@@ -363,9 +453,8 @@ class HacktoberStats(commands.Cog):
 
         # loop through reviews and check for approval
         for item in jsonresp2:
-            if "status" in item.keys():
-                if item['status'] == "APPROVED":
-                    return True
+            if item.get("status") == "APPROVED":
+                return True
         return False
 
     @staticmethod
@@ -378,11 +467,9 @@ class HacktoberStats(commands.Cog):
              V
              "python-discord/sir-lancebot"
         """
-        exp = r"https?:\/\/api.github.com\/repos\/([/\-\_\.\w]+)"
-        return re.findall(exp, in_url)[0]
+        return REPO_SHORTNAME_REGEX.match(in_url).group(1)
 
-    @staticmethod
-    async def _categorize_prs(prs: List[dict]) -> tuple:
+    async def _categorize_prs(self, prs: List[dict]) -> tuple:
         """
         Categorize PRs into 'in_review' and 'accepted' and returns as a tuple.
 
@@ -393,13 +480,12 @@ class HacktoberStats(commands.Cog):
         'hacktoberfest-accepted.
         """
         now = datetime.now()
-        oct3 = datetime(CURRENT_YEAR, 10, 3, 23, 59, 59, tzinfo=None)
         in_review = []
         accepted = []
         for pr in prs:
             if (pr['created_at'] + timedelta(REVIEW_DAYS)) > now:
                 in_review.append(pr)
-            elif (pr['created_at'] <= oct3) or await HacktoberStats._is_accepted(pr):
+            elif (pr['created_at'] <= OCT3) or await self._is_accepted(pr):
                 accepted.append(pr)
 
         return in_review, accepted
@@ -414,8 +500,7 @@ class HacktoberStats(commands.Cog):
         """
         base_url = "https://www.github.com/"
         str_list = []
-        repo_list = [pr["repo_shortname"] for pr in prs]
-        prs_list = Counter(repo_list).most_common(5)  # get first 5 counted PRs
+        prs_list = Counter(pr["repo_shortname"] for pr in prs).most_common(5)  # get first 5 counted PRs
         more = len(prs) - sum(i[1] for i in prs_list)
 
         for pr in prs_list:
@@ -432,14 +517,15 @@ class HacktoberStats(commands.Cog):
     @staticmethod
     def _contributionator(n: int) -> str:
         """Return "contribution" or "contributions" based on the value of n."""
-        if n == 1:
-            return "contribution"
-        else:
-            return "contributions"
+        return "contribution" if n == 1 else "contributions"
 
     @staticmethod
-    def _author_mention_from_context(ctx: commands.Context) -> Tuple:
-        """Return stringified Message author ID and mentionable string from commands.Context."""
+    def _author_mention_from_context(ctx: commands.Context) -> Tuple[str, str]:
+        """
+        Return stringified Message author ID and mentionable string from commands.Context.
+
+        The ID is always a string so it can be used directly as a `linked_accounts` key.
+        """
         author_id = str(ctx.message.author.id)
         author_mention = ctx.message.author.mention
 